@@ -0,0 +1,410 @@
+"""Numpy model of the full_radio digital downconverter.
+
+The mixer rounding, FIR arithmetic, and output packing follow the widths and
+rounding modes in the IP configuration. The model has not been checked
+against HDL simulation or captured vectors, and it assumes:
+
+- DDS sine/cosine values are within 1 LSB of the Xilinx core, whose
+  internal table quantization is not published.
+- The mixer samples pair with the LFSR starting DDS_LATENCY clocks after
+  reset.
+- Each decimator output uses the D most recent inputs ending on a block
+  of D, starting from the first sample after reset.
+"""
+
+from argparse import ArgumentParser
+import os
+import sys
+from time import perf_counter
+
+import numpy as np
+
+from radio import CLOCK_RATE_HZ, DDS_PHASE_WIDTH, DECIMATION, OUTPUT_RATE_HZ
+
+COE_DIR: str = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            '..', '..', 'ip_repo', 'full_radio', 'src')
+
+# dds_compiler_0/1: Taylor series corrected, unit circle amplitude
+DDS_OUTPUT_WIDTH      : int = 16
+DDS_PHASE_ANGLE_WIDTH : int = 11
+DDS_AMPLITUDE         : int = 2**(DDS_OUTPUT_WIDTH-2) # Unit circle, 0b0100...
+DDS_LATENCY           : int = 8
+
+# cmpy_0: 16x16 complex multiply, 33-bit full precision, 19-bit output
+CMPY_FULL_WIDTH   : int = 33
+CMPY_OUTPUT_WIDTH : int = 19
+
+# Lfsr_Inst: provides the cmpy random rounding carry
+LFSR_ORDER : int = 32
+LFSR_POLY  : int = 0xB4BC_D35C
+LFSR_SEED  : int = 0xFFFF_FFFF
+
+# fir_compiler_0/1: accumulator widths from C_ACCUM_OP_PATH_WIDTHS
+FIR1_DECIMATION   : int = 40
+FIR1_ACCUM_WIDTH  : int = 39
+FIR1_OUTPUT_WIDTH : int = 20
+FIR2_DECIMATION   : int = 64
+FIR2_ACCUM_WIDTH  : int = 40
+FIR2_OUTPUT_WIDTH : int = 21
+
+# Output_Reg_Proc keeps the low 16 bits of each FIR2 output lane
+IQ_WIDTH          : int = 16
+TOTAL_DECIMATION  : int = FIR1_DECIMATION * FIR2_DECIMATION
+
+# Outputs computed per pass so the 125 MHz intermediates stay in cache
+CHUNK_SAMPLES     : int = 8
+
+
+def read_coe(path: str) -> np.ndarray:
+    """Parse a Xilinx .coe file into an array of integer coefficients."""
+    with open(path, 'r') as f:
+        text = f.read()
+    fields = {}
+    for stmt in text.split(';'):
+        if '=' in stmt:
+            key, val = stmt.split('=', 1)
+            fields[key.strip().lower()] = val
+    radix = int(fields.get('radix', '10'))
+    coefs = [int(c.strip(), radix) for c in fields['coefdata'].split(',') if c.strip()]
+    return np.array(coefs, dtype=np.int64)
+
+
+def wrap(x: np.ndarray, width: int) -> np.ndarray:
+    """Reinterpret the low width bits of x as a two's complement integer."""
+    half = 1 << (width - 1)
+    return ((x + half) & ((1 << width) - 1)) - half
+
+
+def round_convergent(x: np.ndarray, shift: int) -> np.ndarray:
+    """Drop shift LSBs using convergent rounding (round half to even)."""
+    q = x >> shift
+    r = x & ((1 << shift) - 1)
+    half = 1 << (shift - 1)
+    return q + ((r > half) | ((r == half) & (q & 1 == 1)))
+
+
+def phase_incr(freq_hz: float) -> int:
+    """Phase increment for a DDS frequency, as written by radio.cmd_tone."""
+    return round((freq_hz / CLOCK_RATE_HZ) * 2**DDS_PHASE_WIDTH)
+
+
+def tune_phase_incr(freq_hz: float) -> int:
+    """Phase increment for a tune frequency, as written by radio.cmd_tune."""
+    return phase_incr(CLOCK_RATE_HZ - freq_hz)
+
+
+def pack_iq(i: np.ndarray, q: np.ndarray) -> np.ndarray:
+    """Pack I and Q into FIFO words: Q in bits 31:16, I in bits 15:0."""
+    mask = (1 << IQ_WIDTH) - 1
+    return ((q.astype(np.int64) & mask) << IQ_WIDTH | (i.astype(np.int64) & mask)).astype(np.uint32)
+
+
+class Lfsr:
+    """Galois LFSR matching lfsr.vhd, evaluated at arbitrary clock cycles.
+
+    Only the cmpy rounding carry at exact rounding ties depends on the LFSR,
+    so instead of stepping it every clock the state n cycles ahead is found
+    by applying precomputed GF(2) jump matrices M**(2**k). Each matrix is
+    stored as four byte-indexed tables so a jump is four gathers and XORs.
+    """
+    def __init__(self, poly: int = LFSR_POLY, seed: int = LFSR_SEED):
+        # Column j is the next state of a register holding only bit j
+        cols = np.array([poly] + [1 << (j-1) for j in range(1, LFSR_ORDER)], dtype=np.uint32)
+        self._jumps = []
+        for _ in range(64):
+            table = self._table(cols)
+            self._jumps.append(table)
+            cols = self._matvec(table, cols)
+        self.seed = seed
+        self.reset()
+
+    @staticmethod
+    def _table(cols: np.ndarray) -> np.ndarray:
+        table = np.zeros((LFSR_ORDER // 8, 256), dtype=np.uint32)
+        for b in range(LFSR_ORDER // 8):
+            for i in range(8):
+                table[b, 1 << i : 2 << i] = table[b, : 1 << i] ^ cols[8*b + i]
+        return table
+
+    @staticmethod
+    def _matvec(table: np.ndarray, v: np.ndarray) -> np.ndarray:
+        out = table[0][v & 0xFF]
+        for b in range(1, LFSR_ORDER // 8):
+            out ^= table[b][(v >> (8*b)) & 0xFF]
+        return out
+
+    def reset(self) -> None:
+        self.state = np.uint32(self.seed)
+
+    def peek(self, n: np.ndarray) -> np.ndarray:
+        """State n clocks after the current one, for an array of n."""
+        n = np.asarray(n, dtype=np.int64)
+        s = np.full(n.shape, self.state, dtype=np.uint32)
+        num_bits = int(n.max()).bit_length() if n.size else 0
+        for k in range(num_bits):
+            sel = ((n >> k) & 1).astype(bool)
+            if sel.any():
+                s[sel] = self._matvec(self._jumps[k], s[sel])
+        return s
+
+    def advance(self, n: int) -> None:
+        """Step the LFSR forward n clocks."""
+        self.state = self.peek(np.array([n]))[0]
+
+
+class Dds:
+    """Phase accumulator with a Taylor series corrected sine/cosine lookup."""
+    _angles = 2*np.pi*np.arange(2**DDS_PHASE_ANGLE_WIDTH) / 2**DDS_PHASE_ANGLE_WIDTH
+    _sin = DDS_AMPLITUDE*np.sin(_angles)
+    _cos = DDS_AMPLITUDE*np.cos(_angles)
+
+    def __init__(self, phase_incr: int = 0):
+        self.phase_incr = phase_incr
+        self.phase = 0
+
+    def generate(self, num_samples: int) -> tuple:
+        """Return (cosine, sine) for the next num_samples clocks."""
+        mask = (1 << DDS_PHASE_WIDTH) - 1
+        # int32 wraps modulo 2**32, which is a multiple of the accumulator modulus
+        acc = np.arange(num_samples, dtype=np.int32)
+        acc *= np.int32(wrap(self.phase_incr, 32))
+        acc += np.int32(self.phase)
+        acc &= mask
+        self.phase = (self.phase + self.phase_incr*num_samples) & mask
+        residual_bits = DDS_PHASE_WIDTH - DDS_PHASE_ANGLE_WIDTH
+        idx = acc >> residual_bits
+        delta = (acc & ((1 << residual_bits) - 1)).astype(np.float64)
+        delta *= 2*np.pi / 2**DDS_PHASE_WIDTH
+        s = self._sin[idx]
+        c = self._cos[idx]
+        cos = delta*s
+        np.subtract(c, cos, out=cos)
+        sin = delta
+        sin *= c
+        sin += s
+        return np.rint(cos).astype(np.int32), np.rint(sin).astype(np.int32)
+
+
+def cmpy(a_re: np.ndarray, a_im: np.ndarray, b_re: np.ndarray, b_im: np.ndarray,
+         round_cy) -> tuple:
+    """Complex multiply with cmpy_0 random rounding to 19 bits.
+
+    round_cy is a callable taking the indices of rounding ties and returning
+    the carry bit at each, so the LFSR only has to be evaluated at ties.
+    Products of 16-bit unit circle inputs fit in int32.
+    """
+    shift = CMPY_FULL_WIDTH - CMPY_OUTPUT_WIDTH
+    half = 1 << (shift - 1)
+    out = []
+    for p in (a_re*b_re - a_im*b_im, a_re*b_im + a_im*b_re):
+        y = (p + half - 1) >> shift
+        ties = np.flatnonzero((p & ((1 << shift) - 1)) == half)
+        if ties.size:
+            y[ties] += round_cy(ties).astype(y.dtype)
+        out.append(wrap(y, CMPY_OUTPUT_WIDTH))
+    return tuple(out)
+
+
+class FirDecimator:
+    """Polyphase decimating FIR matching fir_compiler in integer mode.
+
+    Output m is computed once inputs m*D through m*D+D-1 have arrived. The
+    taps are split into D-wide phases so that each output row is a sum of
+    a few (rows, D) @ (D,) products over a reshaped view of the input,
+    with no per-tap work. Partial sums stay below 2**53 so float64 BLAS is
+    exact, and the accumulator is rounded to the output width afterwards.
+    """
+    def __init__(self, coefs: np.ndarray, decimation: int, accum_width: int, output_width: int):
+        self.decimation = decimation
+        self.accum_width = accum_width
+        self.output_width = output_width
+        self.num_phases = -(-len(coefs) // decimation)
+        padded = np.zeros(self.num_phases*decimation)
+        padded[:len(coefs)] = coefs
+        # Phase j holds taps j*D..(j+1)*D-1 reversed to line up with input rows
+        self._phases = padded.reshape(self.num_phases, decimation)[:, ::-1].copy()
+        self.reset()
+
+    def reset(self) -> None:
+        self._history = np.zeros((2, (self.num_phases-1)*self.decimation))
+
+    def process(self, x: np.ndarray) -> np.ndarray:
+        """Filter and decimate a (2, N) block of I/Q rows; N must be a multiple of D."""
+        if x.shape[1] % self.decimation:
+            raise ValueError(f'Block length {x.shape[1]} is not a multiple of {self.decimation}.')
+        u = np.concatenate((self._history, x), axis=1)
+        self._history = u[:, u.shape[1]-self._history.shape[1]:].copy()
+        rows = u.reshape(2, -1, self.decimation)
+        num_out = x.shape[1] // self.decimation
+        k = self.num_phases - 1
+        acc = rows[:, k:k+num_out] @ self._phases[0]
+        for j in range(1, self.num_phases):
+            acc += rows[:, k-j:k-j+num_out] @ self._phases[j]
+        acc = wrap(acc.astype(np.int64), self.accum_width)
+        y = round_convergent(acc, self.accum_width - self.output_width)
+        return wrap(y, self.output_width)
+
+
+class DdcModel:
+    """Fake ADC, tuner, mixer, and decimation chain of full_radio."""
+    def __init__(self, tone_hz: float = 0.0, tune_hz: float = 0.0,
+                 fir1_path: str = os.path.join(COE_DIR, 'fir1.coe'),
+                 fir2_path: str = os.path.join(COE_DIR, 'fir2.coe')):
+        self.adc = Dds(phase_incr(tone_hz))
+        self.tuner = Dds(tune_phase_incr(tune_hz))
+        self.lfsr = Lfsr()
+        self.lfsr.advance(DDS_LATENCY)
+        self.fir1 = FirDecimator(read_coe(fir1_path), FIR1_DECIMATION, FIR1_ACCUM_WIDTH, FIR1_OUTPUT_WIDTH)
+        self.fir2 = FirDecimator(read_coe(fir2_path), FIR2_DECIMATION, FIR2_ACCUM_WIDTH, FIR2_OUTPUT_WIDTH)
+
+    def set_tone(self, freq_hz: float) -> None:
+        self.adc.phase_incr = phase_incr(freq_hz)
+
+    def set_tune(self, freq_hz: float) -> None:
+        self.tuner.phase_incr = tune_phase_incr(freq_hz)
+
+    def reset(self) -> None:
+        self.adc.phase = 0
+        self.tuner.phase = 0
+        self.fir1.reset()
+        self.fir2.reset()
+        self.lfsr.reset()
+        self.lfsr.advance(DDS_LATENCY)
+
+    def _round_cy(self, ties: np.ndarray) -> np.ndarray:
+        return self.lfsr.peek(ties) & 1
+
+    def generate_iq(self, num_samples: int) -> tuple:
+        """Return the next num_samples (I, Q) outputs as signed 16-bit values."""
+        out = []
+        for k in range(0, num_samples, CHUNK_SAMPLES):
+            n = min(CHUNK_SAMPLES, num_samples - k)*TOTAL_DECIMATION
+            a_re, a_im = self.adc.generate(n)
+            b_re, b_im = self.tuner.generate(n)
+            mixed = np.stack(cmpy(a_re, a_im, b_re, b_im, self._round_cy))
+            self.lfsr.advance(n)
+            out.append(self.fir2.process(self.fir1.process(mixed)))
+        y = np.concatenate(out, axis=1) if out else np.zeros((2, 0), dtype=np.int64)
+        return wrap(y[0], IQ_WIDTH), wrap(y[1], IQ_WIDTH)
+
+    def generate(self, num_samples: int) -> np.ndarray:
+        """Return the next num_samples FIFO words."""
+        return pack_iq(*self.generate_iq(num_samples))
+
+
+def self_check() -> bool:
+    """Check the parts of the model that do not depend on hardware."""
+    results = []
+
+    lfsr = Lfsr()
+    state = LFSR_SEED
+    steps = []
+    for _ in range(3000):
+        steps.append(state)
+        state = (state >> 1) ^ (LFSR_POLY if state & 1 else 0)
+    n = np.array([0, 1, 2, 31, 32, 33, 255, 1000, 2999])
+    results.append(('Lfsr.peek matches stepping', [int(s) for s in lfsr.peek(n)] == [steps[k] for k in n]))
+    lfsr.advance(1234)
+    n = np.arange(1000)
+    results.append(('Lfsr.advance matches stepping', [int(s) for s in lfsr.peek(n)] == steps[1234:2234]))
+
+    x = np.array([-12, -10, -6, -5, -3, -2, 2, 3, 5, 6, 10, 12])
+    expected = np.round(x / 4).astype(np.int64) # numpy rounds half to even
+    results.append(('round_convergent ties to even', np.array_equal(round_convergent(x, 2), expected)))
+
+    rng = np.random.default_rng(0)
+    coefs = read_coe(os.path.join(COE_DIR, 'fir1.coe'))
+    x = rng.integers(-2**18, 2**18, (2, 40*100))
+    fir = FirDecimator(coefs, FIR1_DECIMATION, FIR1_ACCUM_WIDTH, FIR1_OUTPUT_WIDTH)
+    y = np.concatenate((fir.process(x[:, :1600]), fir.process(x[:, 1600:])), axis=1)
+    direct = np.array([np.convolve(row, coefs)[FIR1_DECIMATION-1::FIR1_DECIMATION][:100] for row in x])
+    direct = wrap(round_convergent(direct, FIR1_ACCUM_WIDTH - FIR1_OUTPUT_WIDTH), FIR1_OUTPUT_WIDTH)
+    results.append(('FirDecimator matches direct convolution', np.array_equal(y, direct)))
+
+    model = DdcModel(1_001_000, 1_000_000)
+    whole = model.generate(40)
+    model.reset()
+    blocks = np.concatenate([model.generate(k) for k in (1, 7, 0, 32)])
+    results.append(('DdcModel.generate independent of block size', np.array_equal(whole, blocks)))
+
+    results.append(('FIR decimation matches radio.DECIMATION', TOTAL_DECIMATION == DECIMATION))
+
+    for name, ok in results:
+        print(f'{"PASS" if ok else "FAIL"} : {name}')
+    return all(ok for _, ok in results)
+
+
+def main(args):
+    if args.check:
+        sys.exit(0 if self_check() else 1)
+
+    model = DdcModel(args.tone, args.tune)
+    out = open(args.output, 'wb') if args.output else None
+    print(f'Tone {args.tone} Hz, tune {args.tune} Hz, {args.samples_per_block} samples per block')
+    num_samples = 0
+    start = perf_counter()
+    elapsed = 0.0
+    try:
+        while elapsed < args.seconds:
+            words = model.generate(args.samples_per_block)
+            if out is not None:
+                out.write(words.astype(f'{"<" if args.endian == "little" else ">"}u4').tobytes())
+            num_samples += len(words)
+            elapsed = perf_counter() - start
+    finally:
+        if out is not None:
+            out.close()
+    rate = num_samples / elapsed
+    print(f'Produced {num_samples} samples in {elapsed:.3f} s')
+    print(f'Output rate        : {rate:.1f} samples/s')
+    print(f'Input rate         : {rate*TOTAL_DECIMATION/1e6:.3f} Msamples/s')
+    print(f'Real time factor   : {rate/OUTPUT_RATE_HZ:.3f}x of {OUTPUT_RATE_HZ} Hz')
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Run the DDC model and benchmark its throughput.')
+    parser.add_argument(
+        '--tone',
+        type=float,
+        default=1_001_000.0,
+        help='Fake ADC tone frequency in Hz. Defaults to 1001000.'
+    )
+    parser.add_argument(
+        '--tune',
+        type=float,
+        default=1_000_000.0,
+        help='Tune frequency in Hz. Defaults to 1000000.'
+    )
+    parser.add_argument(
+        '-s', '--samples-per-block',
+        type=int,
+        default=256,
+        help='Number of output samples generated per block. Defaults to 256.'
+    )
+    parser.add_argument(
+        '-t', '--seconds',
+        type=float,
+        default=5.0,
+        help='How long to run the benchmark. Defaults to 5 seconds.'
+    )
+    parser.add_argument(
+        '-o', '--output',
+        type=str,
+        default=None,
+        help='If given, write the FIFO words to this file.'
+    )
+    parser.add_argument(
+        '-e', '--endian',
+        type=str,
+        default='little',
+        choices=('big', 'little'),
+        help='Endianness of the output file. Defaults to little.'
+    )
+    parser.add_argument(
+        '--check',
+        action='store_true',
+        help='Run the self checks and exit.'
+    )
+    args = parser.parse_args()
+
+    main(args)
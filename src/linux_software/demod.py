@@ -0,0 +1,423 @@
+"""Streaming AM/FM/SSB demodulation of IQ sample blocks"""
+
+from argparse import ArgumentParser
+from fractions import Fraction
+from mmap import mmap
+import os
+import socket
+import sys
+from time import perf_counter
+import wave
+
+import numpy as np
+
+from ddc_model import DdcModel
+from radio import OUTPUT_RATE_HZ
+from stream_iq import (IQ_FIFO_BASE_ADDR, IQ_FIFO_SIZE, Axi4sFifo, SignalHandler,
+                       osopen, read_samples, words_to_iq)
+
+SAMPLE_RATE_HZ : float = OUTPUT_RATE_HZ
+AUDIO_RATE_HZ  : int = 48_000
+FULL_SCALE     : int = 2**15
+MODES          : tuple = ('am', 'fm', 'usb', 'lsb')
+
+# Channel filter settings
+CHANNEL_TAPS      : int = 127
+AM_BANDWIDTH_HZ   : float = 10e3
+FM_BANDWIDTH_HZ   : float = 25e3
+FM_DEVIATION_HZ   : float = 5e3
+SSB_LOW_HZ        : float = 300.0
+SSB_HIGH_HZ       : float = 3000.0
+AM_CARRIER_WINDOW : int = 4096    # Samples averaged for the AM carrier level
+RESAMPLE_TAPS     : int = 16      # Taps per polyphase branch
+
+
+def lowpass(num_taps: int, cutoff_hz: float, fs: float) -> np.ndarray:
+    """Kaiser windowed sinc lowpass with unity DC gain."""
+    n = np.arange(num_taps) - (num_taps - 1)/2
+    taps = np.sinc(2*cutoff_hz/fs*n) * np.kaiser(num_taps, 8.0)
+    return taps / np.sum(taps)
+
+
+def bandpass(num_taps: int, low_hz: float, high_hz: float, fs: float) -> np.ndarray:
+    """Complex bandpass passing low_hz to high_hz (either may be negative)."""
+    center = (low_hz + high_hz)/2
+    n = np.arange(num_taps) - (num_taps - 1)/2
+    return lowpass(num_taps, abs(high_hz - low_hz)/2, fs) * np.exp(2j*np.pi*center/fs*n)
+
+
+class Mixer:
+    """Shift a channel at offset_hz down to DC, keeping phase across blocks."""
+    def __init__(self, offset_hz: float, fs: float = SAMPLE_RATE_HZ):
+        self.step = -2*np.pi*offset_hz/fs
+        self.phase = 0.0
+
+    def __call__(self, x: np.ndarray) -> np.ndarray:
+        phase = self.phase + self.step*np.arange(len(x))
+        self.phase = (self.phase + self.step*len(x)) % (2*np.pi)
+        return x * np.exp(1j*phase).astype(np.complex64)
+
+
+class Fir:
+    """FIR filter that carries its delay line across blocks, so output is
+    the same for any block size."""
+    def __init__(self, taps: np.ndarray):
+        self.taps = np.asarray(taps)
+        self.reset()
+
+    def reset(self) -> None:
+        self._history = np.zeros(len(self.taps) - 1, dtype=np.result_type(self.taps, np.complex64))
+
+    def __call__(self, x: np.ndarray) -> np.ndarray:
+        if len(x) == 0:
+            return np.zeros(0, dtype=np.result_type(self._history, x))
+        u = np.concatenate((self._history, x))
+        self._history = u[len(x):]
+        return np.convolve(u, self.taps, 'valid')
+
+
+class AmDemod:
+    """Envelope detector normalized by a moving average of the carrier level."""
+    def __init__(self, window: int = AM_CARRIER_WINDOW):
+        self.window = window
+        self._history = None
+
+    def __call__(self, x: np.ndarray) -> np.ndarray:
+        env = np.abs(x).astype(np.float64)
+        if len(env) == 0:
+            return env
+        if self._history is None:
+            self._history = np.full(self.window, env[0])
+        u = np.concatenate((self._history, env))
+        self._history = u[len(env):]
+        total = np.cumsum(u)
+        carrier = (total[self.window:] - total[:-self.window]) / self.window
+        return (env - carrier) / np.maximum(carrier, 1.0)
+
+
+class FmDemod:
+    """Quadrature discriminator scaled so deviation_hz gives full scale."""
+    def __init__(self, deviation_hz: float = FM_DEVIATION_HZ, fs: float = SAMPLE_RATE_HZ):
+        self.gain = fs / (2*np.pi*deviation_hz)
+        self.last = np.complex64(0)
+
+    def __call__(self, x: np.ndarray) -> np.ndarray:
+        prev = np.concatenate(([self.last], x[:-1]))
+        if len(x):
+            self.last = x[-1]
+        return np.angle(x * np.conj(prev)) * self.gain
+
+
+class Real:
+    """Real part of a sideband filtered signal, scaled to full scale."""
+    def __call__(self, x: np.ndarray) -> np.ndarray:
+        return x.real / FULL_SCALE
+
+
+class Resampler:
+    """Rational polyphase resampler, e.g. 48828.125 Hz to 48 kHz (3072/3125).
+
+    Each output picks its branch of the prototype filter and its input
+    window by index arithmetic, so a block is one gather and one multiply.
+    The output position carries across blocks.
+    """
+    def __init__(self, fs_in: float, fs_out: float, taps_per_branch: int = RESAMPLE_TAPS):
+        ratio = Fraction(fs_out) / Fraction(fs_in)
+        self.up = ratio.numerator
+        self.down = ratio.denominator
+        num_taps = self.up*taps_per_branch
+        cutoff = 0.45*min(fs_in, fs_out)
+        taps = lowpass(num_taps, cutoff, fs_in*self.up) * self.up
+        # Branch p holds taps p, p+up, p+2*up, ...
+        self._branches = taps.reshape(taps_per_branch, self.up).T.copy()
+        self._history = np.zeros(taps_per_branch - 1)
+        self._pos = 0  # Position of the next output in units of 1/up input samples
+
+    def __call__(self, x: np.ndarray) -> np.ndarray:
+        taps_per_branch = self._branches.shape[1]
+        u = np.concatenate((self._history, x))
+        self._history = u[len(x):]
+        end = len(x)*self.up
+        num_out = max(0, -(-(end - self._pos) // self.down))
+        pos = self._pos + self.down*np.arange(num_out)
+        self._pos += self.down*num_out - end
+        base = pos // self.up + taps_per_branch - 1
+        windows = u[base[:, None] - np.arange(taps_per_branch)]
+        return np.sum(windows * self._branches[pos % self.up], axis=1)
+
+
+class Pipeline:
+    """Chain of stages applied to each block, timing every stage."""
+    def __init__(self, *stages):
+        self.stages = stages
+        self.seconds = [0.0]*len(stages)
+
+    def __call__(self, x: np.ndarray) -> np.ndarray:
+        for k, stage in enumerate(self.stages):
+            start = perf_counter()
+            x = stage(x)
+            self.seconds[k] += perf_counter() - start
+        return x
+
+
+def make_channel(mode: str, offset_hz: float = 0.0, audio_rate: float = AUDIO_RATE_HZ) -> Pipeline:
+    """Mixer, channel filter, demodulator, and resampler for one channel."""
+    if mode == 'am':
+        stages = [Fir(lowpass(CHANNEL_TAPS, AM_BANDWIDTH_HZ/2, SAMPLE_RATE_HZ)), AmDemod()]
+    elif mode == 'fm':
+        stages = [Fir(lowpass(CHANNEL_TAPS, FM_BANDWIDTH_HZ/2, SAMPLE_RATE_HZ)), FmDemod()]
+    elif mode == 'usb':
+        stages = [Fir(bandpass(CHANNEL_TAPS, SSB_LOW_HZ, SSB_HIGH_HZ, SAMPLE_RATE_HZ)), Real()]
+    elif mode == 'lsb':
+        stages = [Fir(bandpass(CHANNEL_TAPS, -SSB_HIGH_HZ, -SSB_LOW_HZ, SAMPLE_RATE_HZ)), Real()]
+    else:
+        raise ValueError(f'Invalid mode {mode}. Must be one of {MODES}.')
+    return Pipeline(Mixer(offset_hz), *stages, Resampler(SAMPLE_RATE_HZ, audio_rate))
+
+
+def channel_bandwidth(mode: str) -> float:
+    """Spacing needed between channel offsets so filters do not overlap."""
+    if mode == 'am':
+        return AM_BANDWIDTH_HZ
+    if mode == 'fm':
+        return FM_BANDWIDTH_HZ
+    return SSB_HIGH_HZ
+
+
+def check_offsets(parser: ArgumentParser, mode: str, offsets: list) -> None:
+    """Reject channels that do not fit in the IQ band and warn about
+    channels close enough to leak into each other."""
+    for f in offsets:
+        if abs(f) + channel_bandwidth(mode)/2 > SAMPLE_RATE_HZ/2:
+            parser.error(f'{mode} channel at offset {f} Hz does not fit in the '
+                         f'+/-{SAMPLE_RATE_HZ/2} Hz IQ band.')
+    offsets = sorted(offsets)
+    # The band wraps at fs, so the highest channel also neighbors the lowest
+    spacing = np.append(np.diff(offsets), SAMPLE_RATE_HZ - (offsets[-1] - offsets[0]))
+    if len(offsets) > 1 and spacing.min() < channel_bandwidth(mode):
+        print(f'Warning: channel offsets {spacing.min()} Hz apart are closer than the '
+              f'{channel_bandwidth(mode)} Hz {mode} channel bandwidth. Neighboring '
+              'channels will leak into each other.', file=sys.stderr)
+
+
+def demodulate(blocks, channels: list):
+    """Run every channel on each IQ block, yielding (samples, channels) audio."""
+    for x in blocks:
+        yield np.stack([channel(x) for channel in channels], axis=1)
+
+
+def fifo_blocks(block_size: int, signal_handler: SignalHandler):
+    """IQ blocks drained from the FIFO on the board."""
+    with osopen('/dev/mem', os.O_RDWR) as fd:
+        mm = mmap(fd, IQ_FIFO_SIZE, offset=IQ_FIFO_BASE_ADDR)
+        reg = Axi4sFifo.from_buffer(mm)
+        words = np.empty(block_size, dtype=np.uint32)
+        while not signal_handler.kill and read_samples(reg, words, signal_handler):
+            yield words_to_iq(words)
+
+
+def udp_blocks(ip: str, port: int, endian: str, signal_handler: SignalHandler):
+    """IQ blocks received from stream_iq.py in iq mode."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind((ip, port))
+    sock.settimeout(0.5)
+    dtype = ('<' if endian == 'little' else '>') + 'u4'
+    expected = None
+    while not signal_handler.kill:
+        try:
+            msg = sock.recv(65536)
+        except socket.timeout:
+            continue
+        if len(msg) <= 2 or (len(msg) - 2) % 4: # Skip empty and truncated packets
+            continue
+        pkt_ctr = int.from_bytes(msg[0:2], endian)
+        iq = words_to_iq(np.frombuffer(msg, dtype=dtype, offset=2))
+        if expected is not None and pkt_ctr != expected:
+            lost = (pkt_ctr - expected) % 65535 # Sender rolls over at 65535
+            print(f'Warning: lost {lost} packet(s) before packet {pkt_ctr}', file=sys.stderr)
+            # Fill short gaps with silence to keep channel timing, resync on long ones
+            if lost*len(iq) <= SAMPLE_RATE_HZ:
+                yield np.zeros(lost*len(iq), dtype=iq.dtype)
+        expected = (pkt_ctr + 1) % 65535
+        yield iq
+    sock.close()
+
+
+def model_blocks(tone_hz: float, tune_hz: float, block_size: int, signal_handler: SignalHandler):
+    """IQ blocks from the DDC model, slower than real time."""
+    model = DdcModel(tone_hz, tune_hz)
+    while not signal_handler.kill:
+        yield words_to_iq(model.generate(block_size))
+
+
+def test_blocks(mode: str, seconds: float, block_size: int, offsets: list):
+    """Synthetic 1 kHz modulated carriers at each offset, for benchmarking."""
+    n = np.arange(round(seconds*SAMPLE_RATE_HZ))
+    t = n / SAMPLE_RATE_HZ
+    tone = np.cos(2*np.pi*1e3*t)
+    if mode == 'am':
+        baseband = 1 + 0.5*tone
+    elif mode == 'fm':
+        baseband = np.exp(1j*FM_DEVIATION_HZ/1e3*np.sin(2*np.pi*1e3*t))
+    else:
+        baseband = np.exp(2j*np.pi*(1e3 if mode == 'usb' else -1e3)*t)
+    iq = sum(baseband*np.exp(2j*np.pi*f*t) for f in offsets) * (FULL_SCALE/2/len(offsets))
+    iq = iq.astype(np.complex64)
+    for k in range(0, len(iq), block_size):
+        yield iq[k:k+block_size]
+
+
+def to_pcm(audio: np.ndarray, gain: float) -> bytes:
+    return np.clip(audio*gain*(FULL_SCALE-1), -FULL_SCALE, FULL_SCALE-1).astype('<i2').tobytes()
+
+
+def write_wav(audio_blocks, path: str, num_channels: int, rate: int, gain: float) -> None:
+    with wave.open(path, 'wb') as f:
+        f.setnchannels(num_channels)
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        for audio in audio_blocks:
+            f.writeframes(to_pcm(audio, gain))
+
+
+def write_pipe(audio_blocks, stream, gain: float) -> None:
+    """Raw interleaved signed 16-bit little endian PCM, e.g. for aplay."""
+    for audio in audio_blocks:
+        stream.write(to_pcm(audio, gain))
+        stream.flush()
+
+
+def benchmark(args) -> None:
+    channels = [make_channel(args.mode, f, args.rate) for f in args.offset]
+    blocks = list(test_blocks(args.mode, args.seconds, args.block_size, args.offset))
+    start = perf_counter()
+    for _ in demodulate(blocks, channels):
+        pass
+    elapsed = perf_counter() - start
+    print(f'{args.mode} demodulation of {len(channels)} channel(s), {args.seconds} s of IQ '
+          f'in blocks of {args.block_size}')
+    print(f'{"Stage":<12}{"Seconds":>10}{"x Real Time":>14}')
+    for k, stage in enumerate(channels[0].stages):
+        seconds = sum(channel.seconds[k] for channel in channels) / len(channels)
+        print(f'{type(stage).__name__:<12}{seconds:>10.4f}{args.seconds/seconds:>14.1f}')
+    print(f'Total            : {elapsed:.4f} s ({args.seconds/elapsed:.1f}x real time)')
+    print(f'Channels per CPU : {len(channels)*args.seconds/elapsed:.1f}')
+
+
+def main(args):
+    if args.benchmark:
+        benchmark(args)
+        return
+
+    signal_handler = SignalHandler()
+    if args.source == 'fifo':
+        blocks = fifo_blocks(args.block_size, signal_handler)
+    elif args.source == 'udp':
+        blocks = udp_blocks(args.ip, args.port, args.endian, signal_handler)
+    else:
+        blocks = model_blocks(args.tone, args.tune, args.block_size, signal_handler)
+
+    channels = [make_channel(args.mode, f, args.rate) for f in args.offset]
+    audio_blocks = demodulate(blocks, channels)
+    if args.output == '-':
+        write_pipe(audio_blocks, sys.stdout.buffer, args.gain)
+    else:
+        print(f'Writing {args.mode} audio from {args.source} to {args.output}', file=sys.stderr)
+        write_wav(audio_blocks, args.output, len(channels), args.rate, args.gain)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument(
+        '-m', '--mode',
+        type=str,
+        default='am',
+        choices=MODES,
+        help='Demodulator. Defaults to am.'
+    )
+    parser.add_argument(
+        '-f', '--offset',
+        type=float,
+        nargs='+',
+        default=[0.0],
+        help='Channel offsets in Hz from the tune frequency. One output channel '
+             'per offset. Defaults to 0.'
+    )
+    parser.add_argument(
+        '--source',
+        type=str,
+        default='udp',
+        choices=('fifo', 'udp', 'model'),
+        help='Read IQ from the FIFO on the board, from stream_iq.py over UDP, '
+             'or from ddc_model.py. Defaults to udp.'
+    )
+    parser.add_argument(
+        '-i', '--ip',
+        type=str,
+        default='0.0.0.0',
+        help='IP address to listen on for the udp source. Defaults to 0.0.0.0'
+    )
+    parser.add_argument(
+        '-p', '--port',
+        type=int,
+        default=25344,
+        help='Port to listen on for the udp source. Defaults to 25344.'
+    )
+    parser.add_argument(
+        '-e', '--endian',
+        type=str,
+        default='little',
+        choices=('big', 'little'),
+        help='Endianness of the UDP payload. Defaults to little.'
+    )
+    parser.add_argument(
+        '--tone',
+        type=float,
+        default=1_001_000.0,
+        help='Fake ADC tone frequency for the model source. Defaults to 1001000.'
+    )
+    parser.add_argument(
+        '--tune',
+        type=float,
+        default=1_000_000.0,
+        help='Tune frequency for the model source. Defaults to 1000000.'
+    )
+    parser.add_argument(
+        '-s', '--block-size',
+        type=int,
+        default=1024,
+        help='IQ samples per block for the fifo and model sources. Defaults to 1024.'
+    )
+    parser.add_argument(
+        '-r', '--rate',
+        type=int,
+        default=AUDIO_RATE_HZ,
+        help=f'Audio sample rate in Hz. Defaults to {AUDIO_RATE_HZ}.'
+    )
+    parser.add_argument(
+        '-g', '--gain',
+        type=float,
+        default=1.0,
+        help='Audio gain applied before conversion to 16 bits. Defaults to 1.'
+    )
+    parser.add_argument(
+        '-o', '--output',
+        type=str,
+        default='-',
+        help='WAV file to write, or - for raw PCM on stdout. Defaults to -.'
+    )
+    parser.add_argument(
+        '-b', '--benchmark',
+        action='store_true',
+        help='Report per stage throughput on a synthetic signal and exit.'
+    )
+    parser.add_argument(
+        '-t', '--seconds',
+        type=float,
+        default=5.0,
+        help='Seconds of synthetic IQ to benchmark with. Defaults to 5.'
+    )
+    args = parser.parse_args()
+    check_offsets(parser, args.mode, args.offset)
+
+    main(args)
@@ -16,6 +16,8 @@ RADIO_BASE_ADDR : int = 0x43C0_0000
 RADIO_SIZE      : int = 0x0000_0010
 DDS_PHASE_WIDTH : int = 27
 CLOCK_RATE_HZ   : float = 125e6
+DECIMATION      : int = 2560 # fir_compiler_0 (40) * fir_compiler_1 (64)
+OUTPUT_RATE_HZ  : float = CLOCK_RATE_HZ / DECIMATION
 
 IQ_FIFO_BASE_ADDR: int = 0x43C1_0000
 IQ_FIFO_SIZE: int = 0x0000_0010
@@ -43,6 +45,8 @@ HELP_TEXT = """
 --   port   <port>            : Set the port number for streaming. Defaults to
 --                              25344.
 --   spp    <num>             : Number of samples per packet. Defaults to 256.
+--   mode   iq | spectrum     : Stream raw IQ samples or averaged power
+--                              spectrum frames. Defaults to iq.
 --   stream on | off          : Stream IQ data to the given IP and Port.
 --                              Defaults to off.
 --   volume up | down | [0-9] : Change the DAC volume.
@@ -130,12 +134,13 @@ def cmd_tune(arg: str) -> None:
         print(e)
 
 
-def create_stream(ip: str, port: int, spp: int) -> subprocess.Popen:
-    print(f'{sys.executable} stream_iq.py -i {ip} -p {port} -s {spp}')
+def create_stream(ip: str, port: int, spp: int, mode: str = 'iq') -> subprocess.Popen:
+    print(f'{sys.executable} stream_iq.py -i {ip} -p {port} -s {spp} -m {mode}')
     proc = subprocess.Popen([sys.executable, 'stream_iq.py',
                              '-i', f'{ip}',
                              '-p', f'{port}',
-                             '-s', f'{spp}'],
+                             '-s', f'{spp}',
+                             '-m', f'{mode}'],
                              stdout=subprocess.PIPE,
                              stderr=subprocess.STDOUT)
     return proc
@@ -182,6 +187,12 @@ def get_tune_freq() -> float:
         return -1*((radio.ddc_phase_incr * CLOCK_RATE_HZ / 2**DDS_PHASE_WIDTH) - CLOCK_RATE_HZ)
 
 
+def get_timer() -> int:
+    with osopen('/dev/mem', os.O_RDWR) as fd:
+        radio = RadioRegisters.from_buffer(mmap(fd, RADIO_SIZE, offset=RADIO_BASE_ADDR))
+        return radio.timer
+
+
 def cmd_volume_up() -> None:
     v = codec.get_volume()
     if v < 9:
@@ -201,6 +212,7 @@ def ui():
     ip:str = '127.0.0.1'
     port: int = 25344
     spp: int = 256
+    mode: str = 'iq'
     stream: subprocess.Popen = None
     stream_en: bool = False
     tone_freq: float = get_tone_freq()
@@ -265,6 +277,12 @@ def ui():
             except:
                 print(f'Unable to convert {arg} to int.')
             print(f'Samples per Packet: {spp}')
+        elif cmdl == 'mode':
+            if argl in ('iq', 'spectrum'):
+                mode = argl
+            else:
+                print(f'Invalid mode {arg}. Must be iq or spectrum.')
+            print(f'Stream Mode: {mode}')
         elif cmdl == 'stream':
             if arg in ('off', 'on'):
                 if stream_en:
@@ -274,7 +292,8 @@ def ui():
                     stream = subprocess.Popen([sys.executable, 'stream_iq.py',
                              '-i', f'{ip}',
                              '-p', f'{port}',
-                             '-s', f'{spp}'],
+                             '-s', f'{spp}',
+                             '-m', f'{mode}'],
                              stdout=subprocess.PIPE,
                              stderr=subprocess.STDOUT)
                     print(stream.pid)
@@ -308,6 +327,7 @@ def ui():
             print(f'IP                 : {ip}')
             print(f'Port               : {port}')
             print(f'Sampler per Packet : {spp}')
+            print(f'Mode               : {mode}')
             print(f'Stream             : {"on" if stream_en else "off"}')
             if stream_en:
                 print(f'Stream PID         : {stream.pid}')
@@ -0,0 +1,37 @@
+"""Averaged power spectrum frames for the spectrum streaming mode"""
+
+import numpy as np
+
+FULL_SCALE: int = 2**15
+
+
+class Spectrum:
+    """Averaged power spectrum of overlapping, windowed FFT blocks.
+
+    Samples are kept across calls so blocks overlap frame to frame as well
+    as within a frame. All blocks in a frame are windowed and transformed
+    in a single vectorized FFT.
+    """
+    def __init__(self, fft_size: int, overlap: float, averages: int):
+        self.fft_size = fft_size
+        self.averages = averages
+        self.hop = max(1, round(fft_size*(1 - overlap)))
+        self.window = np.hanning(fft_size)
+        # Scale so a full scale tone reads 0 dBFS
+        self.scale = 1 / (np.sum(self.window)*FULL_SCALE)**2
+        self.frame_size = (averages - 1)*self.hop + fft_size
+        self._buf = np.zeros(0, dtype=np.complex64)
+
+    @property
+    def samples_needed(self) -> int:
+        """New samples required before the next frame can be computed."""
+        return self.frame_size - len(self._buf)
+
+    def frame(self, iq: np.ndarray) -> np.ndarray:
+        """Add samples and return one frame of power in dBFS, DC centered."""
+        buf = np.concatenate((self._buf, iq))
+        blocks = np.lib.stride_tricks.sliding_window_view(buf, self.fft_size)[::self.hop][:self.averages]
+        spec = np.fft.fft(blocks*self.window, axis=1)
+        power = np.mean(spec.real**2 + spec.imag**2, axis=0)*self.scale
+        self._buf = buf[self.averages*self.hop:]
+        return np.fft.fftshift(10*np.log10(np.maximum(power, 1e-20))).astype(np.float32)
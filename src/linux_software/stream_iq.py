@@ -7,12 +7,18 @@ from mmap import mmap
 import os
 import signal
 import socket
+import struct
+from time import perf_counter
 
 
 IQ_FIFO_BASE_ADDR: int = 0x43C1_0000
 IQ_FIFO_SIZE: int = 0x0000_0010
 BYTES_PER_SAMPLE: int = 4
 
+# Spectrum frame header: packet count, timer, tune frequency, FFT size, averages
+SPECTRUM_HEADER: str = 'HIdHH'
+MAX_UDP_PAYLOAD: int = 65507
+
 
 class SignalHandler:
     def __init__(self):
@@ -49,23 +55,146 @@ class Axi4sFifo(Structure):
     ]
 
 
+def read_samples(reg: Axi4sFifo, buf, signal_handler: SignalHandler) -> bool:
+    """Fill buf with FIFO words. Returns False if interrupted."""
+    for k in range(len(buf)):
+        while reg.fifo_empty:
+            if signal_handler.kill:
+                return False
+        buf[k] = reg.fifo_data
+    return True
+
+
+def unpack_iq(words) -> tuple:
+    """Split FIFO words into signed 16-bit I and Q arrays."""
+    import numpy as np
+    words = np.asarray(words, dtype=np.uint32)
+    i = (words & 0xFFFF).astype(np.uint16).view(np.int16)
+    q = (words >> 16).astype(np.uint16).view(np.int16)
+    return i, q
+
+
+def words_to_iq(words):
+    """Convert FIFO words to a complex64 array."""
+    import numpy as np
+    i, q = unpack_iq(words)
+    iq = np.empty(len(words), dtype=np.complex64)
+    iq.real = i
+    iq.imag = q
+    return iq
+
+
+def stream_iq(args, reg: Axi4sFifo, sock: socket.socket, signal_handler: SignalHandler) -> None:
+    pkt_ctr = 0
+    msg = bytearray(args.samples_per_packet*BYTES_PER_SAMPLE+2) # +2 for pkt count
+    while not signal_handler.kill:
+        msg[0:2] = int.to_bytes(pkt_ctr, 2, args.endian)
+        for k in range(args.samples_per_packet):
+            while reg.fifo_empty:
+                pass
+            msg[k*BYTES_PER_SAMPLE+2 : (k+1)*BYTES_PER_SAMPLE+2] = int.to_bytes(reg.fifo_data, BYTES_PER_SAMPLE, args.endian)
+        sock.sendto(msg, (args.ip, args.port))
+        pkt_ctr = (pkt_ctr + 1) % 65535 # 16-bit rollover
+
+
+def send_spectrum_frame(args, reg: Axi4sFifo, sock: socket.socket, signal_handler: SignalHandler,
+                        spectrum, pkt_ctr: int, tags) -> bool:
+    """Drain one frame of samples, then compute and send it. Returns False if interrupted."""
+    import numpy as np
+    endian = '<' if args.endian == 'little' else '>'
+    words = np.empty(spectrum.samples_needed, dtype=np.uint32)
+    if not read_samples(reg, words, signal_handler):
+        return False
+    timer, tune_freq = tags()
+    header = struct.pack(endian + SPECTRUM_HEADER, pkt_ctr, timer, tune_freq,
+                         spectrum.fft_size, spectrum.averages)
+    power = spectrum.frame(words_to_iq(words))
+    sock.sendto(header + power.astype(endian + 'f4').tobytes(), (args.ip, args.port))
+    return True
+
+
+def radio_tags() -> tuple:
+    from radio import get_timer, get_tune_freq
+    return get_timer(), get_tune_freq()
+
+
+def stream_spectrum(args, reg: Axi4sFifo, sock: socket.socket, signal_handler: SignalHandler) -> None:
+    from spectrum import Spectrum
+    spectrum = Spectrum(args.fft_size, args.overlap, args.averages)
+    pkt_ctr = 0
+    while not signal_handler.kill:
+        if not send_spectrum_frame(args, reg, sock, signal_handler, spectrum, pkt_ctr, radio_tags):
+            break
+        pkt_ctr = (pkt_ctr + 1) % 65535 # 16-bit rollover
+
+
+def no_tags() -> tuple:
+    return 0, 0.0
+
+
+def benchmark(args) -> None:
+    """Time full frame iterations: FIFO drain, tag reads, FFT, and sendto.
+
+    The FIFO register is a stub in memory that is never empty, so this
+    measures CPU cost, not the FIFO rate. The timer and tune frequency are
+    read from /dev/mem when it is available, as on the board.
+    """
+    from radio import OUTPUT_RATE_HZ
+    from spectrum import Spectrum
+    spectrum = Spectrum(args.fft_size, args.overlap, args.averages)
+    signal_handler = SignalHandler()
+    reg = Axi4sFifo(fifo_empty=0, fifo_data=0x1234_5678)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        radio_tags()
+        tags = radio_tags
+    except OSError as e:
+        print(f'Unable to read radio registers ({e}). Timing without timer and tune frequency reads.')
+        tags = no_tags
+    num_frames = 0
+    start = perf_counter()
+    elapsed = 0.0
+    while elapsed < args.seconds and not signal_handler.kill:
+        send_spectrum_frame(args, reg, sock, signal_handler, spectrum, num_frames % 65535, tags)
+        num_frames += 1
+        elapsed = perf_counter() - start
+    sock.close()
+    required = OUTPUT_RATE_HZ / (spectrum.hop*spectrum.averages)
+    achieved = num_frames / elapsed
+    print(f'FFT size {spectrum.fft_size}, hop {spectrum.hop}, {spectrum.averages} averages')
+    print(f'Achievable frames/s : {achieved:.1f}')
+    print(f'Required frames/s   : {required:.1f} to keep up with the FIFO at {OUTPUT_RATE_HZ} Hz')
+    print(f'Headroom            : {achieved/required:.2f}x')
+
+
+def check_args(parser: ArgumentParser, args) -> None:
+    if args.benchmark and args.mode != 'spectrum':
+        parser.error('--benchmark requires --mode spectrum.')
+    if args.mode == 'spectrum':
+        frame_bytes = struct.calcsize('=' + SPECTRUM_HEADER) + 4*args.fft_size
+        if args.fft_size < 1 or frame_bytes > MAX_UDP_PAYLOAD:
+            parser.error(f'FFT size {args.fft_size} must be positive and fit in a UDP packet.')
+        if not 1 <= args.averages <= 65535:
+            parser.error(f'Averages {args.averages} must be between 1 and 65535.')
+        if not 0 <= args.overlap < 1:
+            parser.error(f'Overlap {args.overlap} must be in [0, 1).')
+
+
 def main(args):
+    if args.benchmark:
+        benchmark(args)
+        return
+
     signal_handler = SignalHandler()
-    print(f'Sending {args.endian} endian IQ stream to {args.ip} at port {args.port}')
+    print(f'Sending {args.endian} endian {args.mode} stream to {args.ip} at port {args.port}')
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM) # UDP
-    pkt_ctr = 0
-    msg = bytearray(args.samples_per_packet*BYTES_PER_SAMPLE+2) # +2 for pkt count
     with osopen('/dev/mem', os.O_RDWR) as fd:
         mm = mmap(fd, IQ_FIFO_SIZE, offset=IQ_FIFO_BASE_ADDR)
         reg = Axi4sFifo.from_buffer(mm)
-        while not signal_handler.kill:
-            msg[0:2] = int.to_bytes(pkt_ctr, 2, args.endian)
-            for k in range(args.samples_per_packet):
-                while reg.fifo_empty:
-                    pass
-                msg[k*BYTES_PER_SAMPLE+2 : (k+1)*BYTES_PER_SAMPLE+2] = int.to_bytes(reg.fifo_data, BYTES_PER_SAMPLE, args.endian)
-            sock.sendto(msg, (args.ip, args.port))
-            pkt_ctr = (pkt_ctr + 1) % 65535 # 16-bit rollover
+        if args.mode == 'spectrum':
+            stream_spectrum(args, reg, sock, signal_handler)
+        else:
+            stream_iq(args, reg, sock, signal_handler)
     print(' ')
 
 
@@ -96,6 +225,43 @@ if __name__ == '__main__':
         choices=('big', 'little'),
         help='Endianness of the UDP payload. Defaults to little.'
     )
+    parser.add_argument(
+        '-m', '--mode',
+        type=str,
+        default='iq',
+        choices=('iq', 'spectrum'),
+        help='Stream raw IQ samples or averaged power spectrum frames. Defaults to iq.'
+    )
+    parser.add_argument(
+        '-n', '--fft-size',
+        type=int,
+        default=1024,
+        help='Spectrum mode FFT size. Defaults to 1024.'
+    )
+    parser.add_argument(
+        '-o', '--overlap',
+        type=float,
+        default=0.5,
+        help='Spectrum mode fractional overlap between FFT blocks. Defaults to 0.5.'
+    )
+    parser.add_argument(
+        '-a', '--averages',
+        type=int,
+        default=8,
+        help='Spectrum mode number of FFT blocks averaged per frame. Defaults to 8.'
+    )
+    parser.add_argument(
+        '-b', '--benchmark',
+        action='store_true',
+        help='Spectrum mode only. Report achievable frames per second and exit.'
+    )
+    parser.add_argument(
+        '-t', '--seconds',
+        type=float,
+        default=5.0,
+        help='How long to run the benchmark. Defaults to 5 seconds.'
+    )
     args = parser.parse_args()
+    check_args(parser, args)
 
     main(args)